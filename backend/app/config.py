@@ -8,7 +8,23 @@ class Settings(BaseSettings):
     openrouter_api_key: str = ""
     openrouter_model: str = "anthropic/claude-3-haiku"
     openrouter_base_url: str = "https://openrouter.ai/api/v1"
-    
+
+    # Model Routing Configuration
+    # openrouter_model is used for small inputs, the long-context model for large ones.
+    # Small inputs fail over to the fallback models first and only then to the long-context model.
+    # Large inputs can only fail over to the fallback models, so keep at least one long-context model here.
+    openrouter_long_context_model: str = "anthropic/claude-3.5-sonnet"
+    openrouter_fallback_models: List[str] = ["openai/gpt-4o-mini"]
+    routing_long_context_threshold_chars: int = 24000
+    routing_latency_window: int = 50
+    routing_slow_ttft_seconds: float = 6.0
+    routing_ttft_timeout_seconds: float = 20.0
+    routing_failure_threshold: int = 2
+    routing_failure_cooldown_seconds: float = 30.0
+    routing_hedge_enabled: bool = False
+    routing_hedge_delay_seconds: float = 2.0
+    routing_request_timeout_seconds: float = 60.0
+
     # Agent Configuration
     agent_name: str = "FileProcessorAgent"
     agent_description: str = "AI agent for processing and analyzing text files"
@@ -43,6 +43,7 @@ class AgentStatus(BaseModel):
     model: str
     available: bool
     last_used: Optional[datetime]
+    routing: Optional[Dict[str, Any]] = None
 
 class ErrorResponse(BaseModel):
     error: str
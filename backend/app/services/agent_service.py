@@ -1,10 +1,30 @@
 
+import asyncio
 import httpx
 import json
+import time
 from typing import List, Dict, Any, Optional, AsyncGenerator
 from datetime import datetime
 from ..config import settings
 from ..models import ChatMessage
+from .model_router import model_router
+
+class ModelRequestError(Exception):
+    """Raised when a model request fails before producing a usable response"""
+    
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+    
+    @property
+    def is_auth_error(self) -> bool:
+        """Bad or unauthorized API key, no other model will do better"""
+        return self.status_code in (401, 403)
+    
+    @property
+    def counts_as_failure(self) -> bool:
+        """Whether the error says something about the model's health"""
+        return self.status_code is None or self.status_code >= 500 or self.status_code in (408, 429)
 
 class AgentService:
     def __init__(self):
@@ -15,7 +35,8 @@ class AgentService:
                 "Content-Type": "application/json",
                 "HTTP-Referer": "http://localhost:3000",
                 "X-Title": "Agent UI Challenge"
-            }
+            },
+            timeout=settings.routing_request_timeout_seconds
         )
         self.conversation_history: Dict[str, List[ChatMessage]] = {}
     
@@ -44,25 +65,18 @@ class AgentService:
             {f'Additional instructions: {instructions}' if instructions else ''}
             """
             
-            response = await self.client.post(
-                "/chat/completions",
-                json={
-                    "model": settings.openrouter_model,
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_message}
-                    ],
-                    "max_tokens": 1000,
-                    "temperature": 0.7
-                }
-            )
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_message}
+            ]
             
-            if response.status_code == 200:
-                result = response.json()
-                return result["choices"][0]["message"]["content"]
-            else:
-                return f"Error processing content: {response.text}"
+            chunks = []
+            async for content_chunk in self._routed_completion(messages):
+                chunks.append(content_chunk)
+            return "".join(chunks)
                 
+        except ModelRequestError as e:
+            return f"Error processing content: {str(e)}"
         except Exception as e:
             return f"Error in agent processing: {str(e)}"
     
@@ -109,51 +123,225 @@ class AgentService:
             
             messages.append({"role": "user", "content": current_message})
             
-            # Make streaming request
-            async with self.client.stream(
-                "POST",
-                "/chat/completions",
-                json={
-                    "model": settings.openrouter_model,
-                    "messages": messages,
-                    "max_tokens": 1000,
-                    "temperature": 0.7,
-                    "stream": True
-                }
-            ) as response:
-                if response.status_code != 200:
-                    yield f"Error: {response.text}"
-                    return
+            # Make routed streaming request
+            full_response = ""
+            async for content_chunk in self._routed_completion(messages):
+                full_response += content_chunk
+                yield content_chunk
+            
+            # Store conversation history
+            history.append(ChatMessage(role="user", content=message, timestamp=datetime.now()))
+            history.append(ChatMessage(role="assistant", content=full_response, timestamp=datetime.now()))
+            
+            # Keep only last 10 messages to manage memory
+            if len(history) > 10:
+                history = history[-10:]
+                self.conversation_history[conversation_id] = history
+                    
+        except ModelRequestError as e:
+            yield f"Error: {str(e)}"
+        except Exception as e:
+            yield f"Error in chat: {str(e)}"
+    
+    async def _stream_completion(self, model: str, messages: List[Dict[str, str]]) -> AsyncGenerator[str, None]:
+        """Stream content chunks from a single model"""
+        async with self.client.stream(
+            "POST",
+            "/chat/completions",
+            json={
+                "model": model,
+                "messages": messages,
+                "max_tokens": 1000,
+                "temperature": 0.7,
+                "stream": True
+            }
+        ) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise ModelRequestError(response.text, response.status_code)
+            
+            async for line in response.aiter_lines():
+                if line.startswith("data: "):
+                    data = line[6:]  # Remove "data: " prefix
+                    if data == "[DONE]":
+                        break
+                    
+                    try:
+                        parsed = json.loads(data)
+                    except json.JSONDecodeError:
+                        continue
+                    
+                    # OpenRouter reports mid-stream failures as an error event
+                    if parsed.get("error"):
+                        error = parsed["error"]
+                        if isinstance(error, dict):
+                            code = error.get("code")
+                            raise ModelRequestError(
+                                error.get("message", str(error)), code if isinstance(code, int) else None
+                            )
+                        raise ModelRequestError(str(error))
+                    
+                    if "choices" in parsed and parsed["choices"]:
+                        choice = parsed["choices"][0]
+                        if choice.get("finish_reason") == "error":
+                            raise ModelRequestError("Stream finished with an error")
+                        content_chunk = choice.get("delta", {}).get("content")
+                        if content_chunk:
+                            yield content_chunk
+    
+    async def _next_chunk(self, stream: AsyncGenerator[str, None]) -> str:
+        """Await the first chunk of a stream, an empty stream raises ModelRequestError"""
+        try:
+            return await stream.__anext__()
+        except StopAsyncIteration:
+            raise ModelRequestError("Model returned an empty response")
+    
+    async def _close_attempt(self, task: asyncio.Task, stream: AsyncGenerator[str, None]):
+        """Cancel a pending attempt and wait for it before aclose(), which fails on a running generator"""
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await stream.aclose()
+    
+    async def _routed_completion(self, messages: List[Dict[str, str]]) -> AsyncGenerator[str, None]:
+        """
+        Stream a completion from the model picked by the router.
+        
+        Fails over to the next candidate when a model errors or exceeds the
+        time-to-first-token limit. With hedging enabled a backup request is
+        started after the hedge delay and the first model to answer wins.
+        Failover is only possible before the first chunk is yielded.
+        
+        Empty streams and in-stream error events are treated as failed
+        attempts. Only 5xx, 408, 429 and transport errors count against a
+        model's health; 401/403 are raised right away since every model
+        shares the same API key.
+        """
+        input_chars = sum(len(msg["content"]) for msg in messages)
+        selection = model_router.select_models(input_chars)
+        queue = list(selection["candidates"])
+        attempts: Dict[asyncio.Task, Dict[str, Any]] = {}
+        errors: List[str] = []
+        hedged = False
+        request_started = time.monotonic()
+        
+        def launch():
+            model = queue.pop(0)
+            stream = self._stream_completion(model, messages)
+            task = asyncio.ensure_future(self._next_chunk(stream))
+            attempts[task] = {"model": model, "stream": stream, "started": time.monotonic()}
+        
+        launch()
+        winner = None
+        first_chunk = ""
+        first_chunk_at = request_started
+        try:
+            while attempts and winner is None:
+                now = time.monotonic()
+                deadlines = [a["started"] + settings.routing_ttft_timeout_seconds for a in attempts.values()]
+                hedge_at = None
+                if settings.routing_hedge_enabled and queue and len(attempts) == 1:
+                    hedge_at = next(iter(attempts.values()))["started"] + settings.routing_hedge_delay_seconds
+                    deadlines.append(hedge_at)
                 
-                full_response = ""
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        data = line[6:]  # Remove "data: " prefix
-                        if data == "[DONE]":
-                            break
-                        
-                        try:
-                            parsed = json.loads(data)
-                            if "choices" in parsed and parsed["choices"]:
-                                delta = parsed["choices"][0].get("delta", {})
-                                if "content" in delta:
-                                    content_chunk = delta["content"]
-                                    full_response += content_chunk
-                                    yield content_chunk
-                        except json.JSONDecodeError:
-                            continue
+                done, _ = await asyncio.wait(
+                    list(attempts), timeout=max(0, min(deadlines) - now), return_when=asyncio.FIRST_COMPLETED
+                )
+                now = time.monotonic()
                 
-                # Store conversation history
-                history.append(ChatMessage(role="user", content=message, timestamp=datetime.now()))
-                history.append(ChatMessage(role="assistant", content=full_response, timestamp=datetime.now()))
+                for task in done:
+                    attempt = attempts.pop(task)
+                    try:
+                        chunk = task.result()
+                    except Exception as e:
+                        await attempt["stream"].aclose()
+                        if isinstance(e, ModelRequestError) and e.is_auth_error:
+                            raise
+                        error = str(e) or type(e).__name__
+                        errors.append(f"{attempt['model']}: {error}")
+                        if not isinstance(e, ModelRequestError) or e.counts_as_failure:
+                            model_router.record_failure(attempt["model"], error)
+                        continue
+                    if winner is None:
+                        winner, first_chunk, first_chunk_at = attempt, chunk, now
+                    else:
+                        await attempt["stream"].aclose()
                 
-                # Keep only last 10 messages to manage memory
-                if len(history) > 10:
-                    history = history[-10:]
-                    self.conversation_history[conversation_id] = history
-                    
+                if winner is not None:
+                    break
+                
+                for task, attempt in list(attempts.items()):
+                    if now - attempt["started"] >= settings.routing_ttft_timeout_seconds:
+                        del attempts[task]
+                        await self._close_attempt(task, attempt["stream"])
+                        errors.append(f"{attempt['model']}: time to first token exceeded")
+                        model_router.record_failure(attempt["model"], "time to first token exceeded")
+                
+                if queue and (not attempts or (hedge_at is not None and now >= hedge_at)):
+                    hedged = hedged or bool(attempts)
+                    launch()
+        finally:
+            # Cancel any attempt that lost the race
+            for task, attempt in attempts.items():
+                if winner is not None and attempt["started"] < winner["started"]:
+                    # Outrun by a later hedge, record it so a consistently slow model gets demoted
+                    model_router.record_lost_hedge(attempt["model"], first_chunk_at - attempt["started"])
+                await self._close_attempt(task, attempt["stream"])
+        
+        decision = {
+            "reason": selection["reason"],
+            "input_chars": input_chars,
+            "candidates": selection["candidates"],
+            "hedged": hedged,
+            "errors": errors,
+        }
+        if winner is None:
+            model_router.record_decision({
+                **decision,
+                "model": None,
+                "status": "failed",
+                "latency": round(time.monotonic() - request_started, 3),
+            })
+            raise ModelRequestError("; ".join(errors) or "No model available")
+        
+        model = winner["model"]
+        stream = winner["stream"]
+        # Only time spent waiting on the model counts, not time the consumer holds the generator
+        streaming_time = 0.0
+        try:
+            yield first_chunk
+            while True:
+                chunk_requested_at = time.monotonic()
+                try:
+                    content_chunk = await stream.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    streaming_time += time.monotonic() - chunk_requested_at
+                yield content_chunk
         except Exception as e:
-            yield f"Error in chat: {str(e)}"
+            error = str(e) or type(e).__name__
+            if not isinstance(e, ModelRequestError) or e.counts_as_failure:
+                model_router.record_failure(model, error)
+            model_router.record_decision({
+                **decision,
+                "model": model,
+                "status": "failed",
+                "errors": errors + [f"{model}: {error}"],
+                "latency": round(first_chunk_at - request_started + streaming_time, 3),
+            })
+            raise
+        finally:
+            await stream.aclose()
+        
+        model_ttft = first_chunk_at - winner["started"]
+        model_router.record_success(model, model_ttft + streaming_time, model_ttft)
+        model_router.record_decision({
+            **decision,
+            "model": model,
+            "status": "completed",
+            "ttft": round(first_chunk_at - request_started, 3),
+            "latency": round(first_chunk_at - request_started + streaming_time, 3),
+        })
     
     def get_status(self) -> Dict[str, Any]:
         """Get agent status"""
@@ -162,7 +350,8 @@ class AgentService:
             "status": "online" if settings.openrouter_api_key else "offline",
             "model": settings.openrouter_model,
             "available": bool(settings.openrouter_api_key),
-            "last_used": datetime.now() if settings.openrouter_api_key else None
+            "last_used": datetime.now() if settings.openrouter_api_key else None,
+            "routing": model_router.get_status()
         }
 
 agent_service = AgentService()
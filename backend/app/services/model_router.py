@@ -0,0 +1,174 @@
+import math
+import time
+from collections import deque
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Deque
+from ..config import settings
+
+def _percentile(values: List[float], percentile: float) -> Optional[float]:
+    """Nearest-rank percentile, None when there are no samples"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, math.ceil(percentile / 100 * len(ordered)) - 1)
+    return round(ordered[index], 3)
+
+class ModelStats:
+    """Rolling latency and error stats for a single model"""
+
+    def __init__(self, window: int):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.ttfts: Deque[float] = deque(maxlen=window)
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_failure_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.lost_hedges = 0
+        self.consecutive_lost_hedges = 0
+        self.slow_since: Optional[float] = None
+
+    def record_success(self, latency: float, ttft: float):
+        self.requests += 1
+        self.consecutive_failures = 0
+        self.consecutive_lost_hedges = 0
+        self.latencies.append(latency)
+        self.ttfts.append(ttft)
+
+    def record_lost_hedge(self, elapsed: float):
+        # The loser had not answered after `elapsed`, so that is a lower bound on its TTFT
+        self.requests += 1
+        self.lost_hedges += 1
+        self.consecutive_lost_hedges += 1
+        self.ttfts.append(elapsed)
+
+    def record_failure(self, error: str):
+        self.requests += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_failure_at = time.monotonic()
+        self.last_error = error
+
+    def is_erroring(self) -> bool:
+        """Model failed repeatedly and is still inside its cooldown period"""
+        if self.consecutive_failures < settings.routing_failure_threshold or self.last_failure_at is None:
+            return False
+        return time.monotonic() - self.last_failure_at < settings.routing_failure_cooldown_seconds
+
+    def is_slow(self) -> bool:
+        """Model was demoted for slow TTFT or lost hedges and is still inside its cooldown period"""
+        now = time.monotonic()
+        if self.slow_since is not None:
+            if now - self.slow_since < settings.routing_failure_cooldown_seconds:
+                return True
+            # Demotion expired: drop the slow evidence so one good probe restores the model
+            self.slow_since = None
+            self.ttfts.clear()
+            self.consecutive_lost_hedges = 0
+            return False
+
+        p95_ttft = _percentile(list(self.ttfts), 95)
+        if self.consecutive_lost_hedges >= settings.routing_failure_threshold or (
+            p95_ttft is not None and p95_ttft > settings.routing_slow_ttft_seconds
+        ):
+            self.slow_since = now
+            return True
+        return False
+
+    def snapshot(self) -> Dict[str, Any]:
+        latencies = list(self.latencies)
+        ttfts = list(self.ttfts)
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "lost_hedges": self.lost_hedges,
+            "healthy": not (self.is_erroring() or self.is_slow()),
+            "latency_p50": _percentile(latencies, 50),
+            "latency_p95": _percentile(latencies, 95),
+            "ttft_p50": _percentile(ttfts, 50),
+            "ttft_p95": _percentile(ttfts, 95),
+        }
+
+class ModelRouter:
+    """Pick a model per request and keep rolling stats used for failover"""
+
+    def __init__(self):
+        self.stats: Dict[str, ModelStats] = {}
+        self.latencies: Deque[float] = deque(maxlen=settings.routing_latency_window)
+        self.ttfts: Deque[float] = deque(maxlen=settings.routing_latency_window)
+        self.outcomes: Deque[bool] = deque(maxlen=settings.routing_latency_window)
+        self.decisions: Deque[Dict[str, Any]] = deque(maxlen=20)
+
+    def _get_stats(self, model: str) -> ModelStats:
+        if model not in self.stats:
+            self.stats[model] = ModelStats(settings.routing_latency_window)
+        return self.stats[model]
+
+    def select_models(self, input_chars: int) -> Dict[str, Any]:
+        """Return the ordered candidate models for a request of the given size"""
+        if input_chars >= settings.routing_long_context_threshold_chars:
+            reason = "long_context"
+            preferred = [settings.openrouter_long_context_model] + settings.openrouter_fallback_models
+        else:
+            # Cheap fallbacks come before the long-context model so failover and hedges stay cheap
+            reason = "small_input"
+            preferred = [settings.openrouter_model] + settings.openrouter_fallback_models + [settings.openrouter_long_context_model]
+
+        candidates = []
+        for model in preferred:
+            if model and model not in candidates:
+                candidates.append(model)
+
+        # Slow or erroring models keep their relative order but move behind healthy ones
+        healthy = [m for m in candidates if not (self._get_stats(m).is_erroring() or self._get_stats(m).is_slow())]
+        degraded = [m for m in candidates if m not in healthy]
+        if degraded and healthy and healthy[0] != candidates[0]:
+            reason = f"{reason}_failover"
+
+        return {"reason": reason, "candidates": healthy + degraded, "degraded": degraded}
+
+    def record_success(self, model: str, latency: float, ttft: float):
+        self._get_stats(model).record_success(latency, ttft)
+
+    def record_failure(self, model: str, error: str):
+        self._get_stats(model).record_failure(error)
+
+    def record_lost_hedge(self, model: str, elapsed: float):
+        self._get_stats(model).record_lost_hedge(elapsed)
+
+    def record_decision(self, decision: Dict[str, Any]):
+        # Overall percentiles are measured from the start of the request, including failover time.
+        # Failed requests are tracked separately so a bad period can't make p95 look better.
+        self.outcomes.append(decision.get("status") == "completed")
+        if decision.get("status") == "completed":
+            self.latencies.append(decision["latency"])
+            self.ttfts.append(decision["ttft"])
+        self.decisions.append({"timestamp": datetime.now().isoformat(), **decision})
+
+    def get_status(self) -> Dict[str, Any]:
+        """Routing configuration, rolling per-model stats and recent decisions"""
+        latencies = list(self.latencies)
+        ttfts = list(self.ttfts)
+        failed = self.outcomes.count(False)
+        return {
+            "small_input_model": settings.openrouter_model,
+            "long_context_model": settings.openrouter_long_context_model,
+            "fallback_models": settings.openrouter_fallback_models,
+            "long_context_threshold_chars": settings.routing_long_context_threshold_chars,
+            "hedging_enabled": settings.routing_hedge_enabled,
+            "overall": {
+                "requests": len(self.outcomes),
+                "failed": failed,
+                "failure_rate": round(failed / len(self.outcomes), 3) if self.outcomes else None,
+                "latency_p50": _percentile(latencies, 50),
+                "latency_p95": _percentile(latencies, 95),
+                "ttft_p50": _percentile(ttfts, 50),
+                "ttft_p95": _percentile(ttfts, 95),
+            },
+            "models": {model: stats.snapshot() for model, stats in self.stats.items()},
+            "recent_decisions": list(self.decisions),
+        }
+
+model_router = ModelRouter()
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import httpx
+import pytest
+from app.config import settings
+from app.services import agent_service as agent_service_module
+from app.services import model_router as model_router_module
+from app.services.agent_service import AgentService, ModelRequestError
+from app.services.model_router import ModelRouter
+
+FAST = "test/fast"
+LONG = "test/long"
+FALLBACK = "test/fallback"
+
+def sse(*events) -> bytes:
+    return "".join(f"data: {json.dumps(event)}\n\n" for event in events).encode() + b"data: [DONE]\n\n"
+
+def content(model: str) -> bytes:
+    return sse({"choices": [{"delta": {"content": model}}]})
+
+@pytest.fixture
+def router(monkeypatch):
+    router = ModelRouter()
+    monkeypatch.setattr(agent_service_module, "model_router", router)
+    monkeypatch.setattr(settings, "openrouter_model", FAST)
+    monkeypatch.setattr(settings, "openrouter_long_context_model", LONG)
+    monkeypatch.setattr(settings, "openrouter_fallback_models", [FALLBACK])
+    monkeypatch.setattr(settings, "routing_long_context_threshold_chars", 1000)
+    monkeypatch.setattr(settings, "routing_ttft_timeout_seconds", 5.0)
+    monkeypatch.setattr(settings, "routing_hedge_enabled", False)
+    monkeypatch.setattr(settings, "routing_hedge_delay_seconds", 0.05)
+    monkeypatch.setattr(settings, "routing_failure_threshold", 2)
+    return router
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(model_router_module, "time", clock)
+    return clock
+
+def run(handler, calls=None) -> str:
+    """Run one routed completion against a mock transport"""
+    async def logged(request):
+        if calls is not None:
+            calls.append(json.loads(request.content)["model"])
+        return await handler(request)
+
+    async def main():
+        service = AgentService()
+        service.client = httpx.AsyncClient(base_url="http://test", transport=httpx.MockTransport(logged))
+        try:
+            messages = [{"role": "user", "content": "hi"}]
+            return "".join([chunk async for chunk in service._routed_completion(messages)])
+        finally:
+            await service.client.aclose()
+
+    return asyncio.run(main())
+
+def test_small_and_large_inputs_pick_different_models(router):
+    assert router.select_models(10)["candidates"] == [FAST, FALLBACK, LONG]
+    assert router.select_models(5000)["candidates"] == [LONG, FALLBACK]
+
+def test_fails_over_on_server_error(router):
+    async def handler(request):
+        if json.loads(request.content)["model"] == FAST:
+            return httpx.Response(500, text="boom")
+        return httpx.Response(200, content=content(json.loads(request.content)["model"]))
+
+    assert run(handler) == FALLBACK
+    assert router.stats[FAST].failures == 1
+    decision = router.decisions[-1]
+    assert decision["model"] == FALLBACK
+    assert decision["status"] == "completed"
+    assert decision["errors"] == [f"{FAST}: boom"]
+
+def test_auth_error_is_raised_without_failover(router):
+    calls = []
+
+    async def handler(request):
+        return httpx.Response(401, text="bad key")
+
+    with pytest.raises(ModelRequestError):
+        run(handler, calls)
+    assert calls == [FAST]
+    assert all(stats.failures == 0 for stats in router.stats.values())
+
+def test_empty_stream_fails_over(router):
+    async def handler(request):
+        if json.loads(request.content)["model"] == FAST:
+            return httpx.Response(200, content=b"data: [DONE]\n\n")
+        return httpx.Response(200, content=content(json.loads(request.content)["model"]))
+
+    assert run(handler) == FALLBACK
+    assert router.stats[FAST].failures == 1
+    assert not router.stats[FAST].ttfts
+
+def test_in_stream_error_event_fails_over(router):
+    async def handler(request):
+        if json.loads(request.content)["model"] == FAST:
+            return httpx.Response(200, content=sse({"error": {"code": 502, "message": "upstream"}}))
+        return httpx.Response(200, content=content(json.loads(request.content)["model"]))
+
+    assert run(handler) == FALLBACK
+    assert router.stats[FAST].last_error == "upstream"
+
+def test_ttft_timeout_fails_over(router, monkeypatch):
+    monkeypatch.setattr(settings, "routing_ttft_timeout_seconds", 0.1)
+
+    async def handler(request):
+        if json.loads(request.content)["model"] == FAST:
+            await asyncio.sleep(1)
+        return httpx.Response(200, content=content(json.loads(request.content)["model"]))
+
+    assert run(handler) == FALLBACK
+    assert router.stats[FAST].last_error == "time to first token exceeded"
+
+def test_hedge_winner_and_loser(router, monkeypatch):
+    monkeypatch.setattr(settings, "routing_hedge_enabled", True)
+
+    async def handler(request):
+        if json.loads(request.content)["model"] == FAST:
+            await asyncio.sleep(0.5)
+        return httpx.Response(200, content=content(json.loads(request.content)["model"]))
+
+    assert run(handler) == FALLBACK
+    assert router.decisions[-1]["hedged"] is True
+    assert router.stats[FAST].lost_hedges == 1
+    assert router.stats[FAST].ttfts[-1] >= settings.routing_hedge_delay_seconds
+    assert router.select_models(10)["candidates"][0] == FAST
+
+    # A model that keeps losing hedges is moved behind faster ones
+    assert run(handler) == FALLBACK
+    assert router.select_models(10)["candidates"] == [FALLBACK, LONG, FAST]
+
+def test_all_models_failing_is_reported(router):
+    async def handler(request):
+        return httpx.Response(503, text="unavailable")
+
+    with pytest.raises(ModelRequestError):
+        run(handler)
+    overall = router.get_status()["overall"]
+    assert overall["failed"] == 1
+    assert overall["failure_rate"] == 1.0
+    assert overall["latency_p95"] is None
+
+def test_slow_model_recovers_after_cooldown(router, clock):
+    for _ in range(30):
+        router.record_success(FAST, 1.0, 0.5)
+    for _ in range(3):
+        router.record_success(FAST, 8.0, settings.routing_slow_ttft_seconds + 1)
+    assert router.select_models(10)["candidates"][-1] == FAST
+
+    clock.now += settings.routing_failure_cooldown_seconds - 1
+    assert router.select_models(10)["candidates"][-1] == FAST
+
+    # Once the demotion expires a single fast probe is enough to keep the model first
+    clock.now += 1
+    assert router.select_models(10)["candidates"][0] == FAST
+    router.record_success(FAST, 1.0, 0.5)
+    clock.now += 5
+    assert router.select_models(10)["candidates"][0] == FAST
+
+def test_slow_probe_demotes_again(router, clock):
+    router.record_success(FAST, 8.0, settings.routing_slow_ttft_seconds + 1)
+    assert router.select_models(10)["candidates"][-1] == FAST
+
+    clock.now += settings.routing_failure_cooldown_seconds
+    assert router.select_models(10)["candidates"][0] == FAST
+    router.record_success(FAST, 8.0, settings.routing_slow_ttft_seconds + 1)
+    assert router.select_models(10)["candidates"][-1] == FAST
+
+def test_erroring_model_recovers_after_cooldown(router, clock):
+    router.record_failure(FAST, "boom")
+    router.record_failure(FAST, "boom")
+    assert router.select_models(10)["candidates"][-1] == FAST
+
+    clock.now += settings.routing_failure_cooldown_seconds
+    assert router.select_models(10)["candidates"][0] == FAST
+    router.record_success(FAST, 1.0, 0.5)
+    assert router.select_models(10)["candidates"][0] == FAST